@@ -3,7 +3,7 @@
 Helper functions for importing product variants from an Excel file.
 
 This module defines functions that:
- - Retrieve or create records for units of measure (UoM).
+ - Prefetch and resolve units of measure (UoM).
  - Manage product attributes and their values.
  - Create or update product variants based on variant data.
  - Update stock quantities for variants.
@@ -12,47 +12,142 @@ This module defines functions that:
 """
 
 import logging
+import sys
+from collections import defaultdict
+from itertools import islice
 
 from odoo import _
 from odoo.exceptions import UserError
+from odoo.osv import expression
 
 _logger = logging.getLogger(__name__)
 
+# Columns holding numbers, coerced once per row by coerce_numeric_columns().
+NUMERIC_COLUMNS = ('sale price', 'cost price', 'stock quantity')
 
-def get_or_create_uom(env, uom_name):
+# Number of templates imported per batch when no commit interval is given.
+IMPORT_BATCH_SIZE = 100
+
+
+def prefetch_uoms(env, uom_names):
     """
-    Retrieve a Unit of Measure (UoM) ID by searching case-insensitively by name.
+    Retrieve the Units of Measure (UoM) referenced by an import in a single query.
+    
+    Names are matched case-insensitively, as a per-name ``=ilike`` search would.
     
     :param env: The current Odoo environment.
+    :param uom_names: Iterable of UoM names referenced by the import.
+    :return: A dictionary mapping lowercased UoM names to their IDs.
+    """
+    names = {name.strip().lower() for name in uom_names if name and name.strip()}
+    if not names:
+        return {}
+    domain = expression.OR([[('name', '=ilike', name)] for name in names])
+    uom_by_name = {}
+    for uom in env['uom.uom'].search_read(domain, ['name']):
+        uom_by_name.setdefault(uom['name'].strip().lower(), uom['id'])
+    return uom_by_name
+
+
+def get_uom_id(uom_by_name, uom_name):
+    """
+    Resolve a Unit of Measure (UoM) ID from the prefetched UoM mapping.
+    
+    :param uom_by_name: Mapping returned by :func:`prefetch_uoms`.
     :param uom_name: The name of the UoM.
     :return: The ID of the UoM.
     :raises UserError: If no matching UoM is found.
     """
     if not uom_name:
         return None
-    uom = env['uom.uom'].search([('name', '=ilike', uom_name)], limit=1)
-    if not uom:
+    uom_id = uom_by_name.get(uom_name.strip().lower())
+    if not uom_id:
         raise UserError(_("Unit of Measure '%s' not found.") % uom_name)
-    return uom.id
+    return uom_id
 
 
-def get_or_create_template_attribute_value(env, template, attribute, attr_val):
+def prefetch_records_by_name(env, model_name, names):
+    """
+    Retrieve the records of a model matching any of the given names in a single query.
+    
+    Names are matched case-insensitively; when several records share a name,
+    the first one in the model's default order is kept, as a per-name
+    ``search(..., limit=1)`` would.
+    
+    :param env: The current Odoo environment.
+    :param model_name: Technical name of the model to search.
+    :param names: Iterable of record names.
+    :return: A dictionary mapping lowercased names to records.
+    """
+    names = {name for name in names if name}
+    if not names:
+        return {}
+    domain = expression.OR([[('name', '=ilike', name)] for name in names])
+    records_by_name = {}
+    # Only fetch the names: the other columns are loaded later, if ever needed.
+    for record in env[model_name].search_fetch(domain, ['name']):
+        records_by_name.setdefault(record.name.lower(), record)
+    return records_by_name
+
+
+def prefetch_template_attribute_values(env, template, attribute_values=None):
+    """
+    Build a cache of the product.template.attribute.value records of a template.
+    
+    When ``attribute_values`` is given, the records still missing for those
+    values are created with a single batched create and added to the cache,
+    so that later lookups never hit the database one value at a time.
+    
+    :param env: The current Odoo environment.
+    :param template: The product.template record.
+    :param attribute_values: Optional mapping of attribute names to dictionaries
+                             of product.attribute.value records.
+    :return: A dictionary mapping ``(template ID, attribute value ID)`` to
+             product.template.attribute.value records.
+    """
+    tmpl_attr_vals = env['product.template.attribute.value'].search([
+        ('product_tmpl_id', '=', template.id),
+    ])
+    cache = {}
+    for tmpl_attr_val in tmpl_attr_vals:
+        cache.setdefault((template.id, tmpl_attr_val.product_attribute_value_id.id), tmpl_attr_val)
+
+    missing = [
+        attr_val
+        for values in (attribute_values or {}).values()
+        for attr_val in values.values()
+        if (template.id, attr_val.id) not in cache
+    ]
+    if missing:
+        created = env['product.template.attribute.value'].create([{
+            'product_tmpl_id': template.id,
+            'product_attribute_id': attr_val.attribute_id.id,
+            'product_attribute_value_id': attr_val.id,
+        } for attr_val in missing])
+        for attr_val, tmpl_attr_val in zip(missing, created):
+            cache[(template.id, attr_val.id)] = tmpl_attr_val
+    return cache
+
+
+def get_or_create_template_attribute_value(cache, env, template, attribute, attr_val):
     """
     Retrieve or create the product.template.attribute.value record that links
     a product template to an attribute value.
     
+    Lookups are served from the cache built by
+    :func:`prefetch_template_attribute_values`; created records are added to it.
+    
+    :param cache: Mapping of ``(template ID, attribute value ID)`` to records.
     :param env: The current Odoo environment.
     :param template: The product.template record.
     :param attribute: The product.attribute record.
     :param attr_val: The product.attribute.value record.
     :return: The product.template.attribute.value record.
     """
-    tmpl_attr_val = env['product.template.attribute.value'].search([
-        ('product_tmpl_id', '=', template.id),
-        ('product_attribute_value_id', '=', attr_val.id)
-    ], limit=1)
+    key = (template.id, attr_val.id)
+    tmpl_attr_val = cache.get(key)
     if not tmpl_attr_val:
-        tmpl_attr_val = env['product.template.attribute.value'].create({
+        tmpl_attr_val = cache[key] = env['product.template.attribute.value'].create({
             'product_tmpl_id': template.id,
             'product_attribute_id': attribute.id,
             'product_attribute_value_id': attr_val.id,
@@ -60,114 +155,219 @@ def get_or_create_template_attribute_value(env, template, attribute, attr_val):
     return tmpl_attr_val
 
 
-def disable_variant_auto_creation(env, template):
+def coerce_numeric_columns(product):
     """
-    Disable automatic variant creation for a product template.
+    Convert the numeric columns of a row to floats in place.
     
-    Based on available fields in the product.template model, this function
-    disables auto-creation so that manual variant creation can be enforced.
+    Numbers become floats and blank cells become None. Text that is not a
+    number is left untouched, so consumers can apply their own fallback
+    through :func:`_safe_float`.
     
-    :param env: The current Odoo environment.
-    :param template: The product.template record.
+    :param product: A dictionary containing product data from Excel.
+    :return: The same dictionary.
     """
-    pt_fields = template._fields
-    if 'create_variant' in pt_fields:
-        template.write({'create_variant': 'no_variant'})
-    elif 'create_variant_ids' in pt_fields:
-        template.write({'create_variant_ids': [(5, 0, 0)]})
-    else:
-        _logger.warning("Could not determine how to disable automatic variant creation.")
+    for column in NUMERIC_COLUMNS:
+        if column not in product:
+            continue
+        value = product[column]
+        if isinstance(value, (int, float)):
+            product[column] = float(value)
+        elif isinstance(value, str):
+            value = value.strip()
+            if not value:
+                product[column] = None
+                continue
+            try:
+                product[column] = float(value)
+            except ValueError:
+                pass
+    return product
+
+
+def _safe_float(value, default=0.0):
+    """
+    Convert an imported cell value to a float.
+    
+    :param value: The cell value, usually already coerced by :func:`coerce_numeric_columns`.
+    :param default: The value returned for blank or non-numeric cells.
+    :return: The float value, or ``default``.
+    """
+    if isinstance(value, float):
+        return value
+    if value is None or value is False or not str(value).strip():
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        # Dates and other non-numeric cells fall back to the default as well.
+        return default
+
+
+def parse_variant(variant_str):
+    """
+    Parse a variant string into its attribute-value pairs.
+    
+    The string is expected to hold "attribute:value" pairs separated by commas.
+    Names and values are stripped and lowercased; attribute names are interned
+    since the same few names repeat on every row.
+    
+    :param variant_str: The variant string, e.g. "Color: Red, Size: M".
+    :return: A tuple of ``(attribute name, value)`` pairs.
+    """
+    if not variant_str:
+        return ()
+    return tuple(
+        (sys.intern(attr_name.strip().lower()), attr_value.strip().lower())
+        for attr_name, attr_value in (part.split(':', 1) for part in variant_str.split(',') if ':' in part)
+    )
+
+
+def get_variant_pairs(product):
+    """
+    Return the parsed variant pairs of a row, parsing its variant string only once.
+    
+    :param product: A dictionary containing variant data from Excel.
+    :return: A tuple of ``(attribute name, value)`` pairs.
+    """
+    pairs = product.get('_parsed_variant')
+    if pairs is None:
+        pairs = product['_parsed_variant'] = parse_variant((product.get('variant') or '').strip())
+    return pairs
 
 
-def setup_template_attributes(env, template, all_variants):
+def prefetch_attribute_values(env, rows):
+    """
+    Resolve all attributes and attribute values used by the rows of an import.
+    
+    Existing records are fetched with one search per model and missing ones
+    are created with one batched create per model.
+    
+    :param env: The current Odoo environment.
+    :param rows: Iterable of dictionaries containing variant data.
+    :return: A tuple ``(attribute_by_name, value_by_key)``: a dictionary mapping
+             lowercased attribute names to product.attribute records, and one
+             mapping ``(attribute ID, lowercased value)`` to
+             product.attribute.value records.
+    """
+    # Dictionaries rather than sets keep the sheet order for created records.
+    names = defaultdict(dict)
+    for product in rows:
+        for attr_name, attr_value in get_variant_pairs(product):
+            names[attr_name][attr_value] = None
+    if not names:
+        return {}, {}
+
+    attribute_by_name = prefetch_records_by_name(env, 'product.attribute', names)
+    missing_names = [attr_name for attr_name in names if attr_name not in attribute_by_name]
+    if missing_names:
+        created = env['product.attribute'].create([{'name': attr_name} for attr_name in missing_names])
+        attribute_by_name.update(zip(missing_names, created))
+
+    value_by_key = {}
+    existing_values = env['product.attribute.value'].search_fetch([
+        ('attribute_id', 'in', [attribute.id for attribute in attribute_by_name.values()])
+    ], ['name', 'attribute_id'])
+    for attr_val in existing_values:
+        value_by_key.setdefault((attr_val.attribute_id.id, attr_val.name.lower()), attr_val)
+
+    missing_values = [
+        {'name': attr_value, 'attribute_id': attribute_by_name[attr_name].id}
+        for attr_name, values in names.items()
+        for attr_value in values
+        if (attribute_by_name[attr_name].id, attr_value) not in value_by_key
+    ]
+    if missing_values:
+        for attr_val in env['product.attribute.value'].create(missing_values):
+            value_by_key[(attr_val.attribute_id.id, attr_val.name.lower())] = attr_val
+    return attribute_by_name, value_by_key
+
+
+def setup_template_attributes(env, template, all_variants, attribute_by_name, value_by_key):
     """
     Setup attribute lines on a product template based on variant data.
     
-    Parses variant strings to extract attribute names and values, creates
-    missing attributes or attribute values, and attaches them to the template.
+    Uses the parsed variant pairs of each row to collect attribute names and
+    values and attaches them to the template. Attributes and values are read
+    from the caches built by :func:`prefetch_attribute_values`. The same pass
+    picks out the rows that describe a variant, so callers do not need to
+    walk and check all rows again.
     
     :param env: The current Odoo environment.
     :param template: The product.template record.
     :param all_variants: List of dictionaries containing variant data.
-    :return: A dictionary mapping attribute names to dictionaries of their values.
+    :param attribute_by_name: Mapping of attribute names to product.attribute records.
+    :param value_by_key: Mapping of ``(attribute ID, value)`` to product.attribute.value records.
+    :return: A tuple ``(attribute_values, variant_rows)``: a dictionary mapping
+             attribute names to dictionaries of their value records, and the list of
+             rows holding at least one attribute-value pair.
     """
-    attribute_values = {}
+    # Dictionaries rather than sets keep the sheet order for values and created records.
+    values_by_attr = defaultdict(dict)
+    variant_rows = []
     for product in all_variants:
-        variant_str = (product.get('variant') or '').strip()
-        if not variant_str:
+        pairs = get_variant_pairs(product)
+        if not pairs:
             continue
-        # Expecting "attribute:value" pairs separated by commas.
-        for part in variant_str.split(','):
-            if ':' in part:
-                attr_name, attr_value = part.split(':', 1)
-                attr_name = attr_name.strip().lower()
-                attr_value = attr_value.strip().lower()
-                if attr_name not in attribute_values:
-                    attribute_values[attr_name] = {}
-                if attr_value not in attribute_values[attr_name]:
-                    attribute_values[attr_name][attr_value] = None
-
-    # For each attribute from the Excel data, search or create on the product template.
-    for attr_name, values in attribute_values.items():
-        attribute = env['product.attribute'].search([('name', '=ilike', attr_name)], limit=1)
-        if not attribute:
-            attribute = env['product.attribute'].create({'name': attr_name})
-        value_ids = []
-        for attr_value in values:
-            attr_val = env['product.attribute.value'].search([
-                ('name', '=ilike', attr_value),
-                ('attribute_id', '=', attribute.id)
-            ], limit=1)
-            if not attr_val:
-                attr_val = env['product.attribute.value'].create({
-                    'name': attr_value,
-                    'attribute_id': attribute.id
-                })
-            attribute_values[attr_name][attr_value] = attr_val
-            value_ids.append(attr_val.id)
+        variant_rows.append(product)
+        for attr_name, attr_value in pairs:
+            values_by_attr[attr_name][attr_value] = None
+
+    # For each attribute from the Excel data, attach its values on the product template.
+    line_by_attr = {line.attribute_id.id: line for line in template.attribute_line_ids}
+    attribute_values = {}
+    commands = []
+    for attr_name, values in values_by_attr.items():
+        attribute = attribute_by_name[attr_name]
+        resolved = attribute_values[attr_name] = {
+            attr_value: value_by_key[(attribute.id, attr_value)] for attr_value in values
+        }
+        value_ids = [attr_val.id for attr_val in resolved.values()]
         # Attach the attribute values to the product template via attribute lines.
-        attr_line = template.attribute_line_ids.filtered(lambda l: l.attribute_id.id == attribute.id)
+        attr_line = line_by_attr.get(attribute.id)
         if attr_line:
-            attr_line.with_context(skip_variant_auto_create=True).write({
-                'value_ids': [(6, 0, value_ids)]
-            })
+            # Lines already holding exactly these values are left untouched.
+            if set(value_ids) != set(attr_line.value_ids.ids):
+                commands.append((1, attr_line.id, {'value_ids': [(6, 0, value_ids)]}))
         else:
-            template.with_context(skip_variant_auto_create=True).write({
-                'attribute_line_ids': [(0, 0, {
-                    'attribute_id': attribute.id,
-                    'value_ids': [(6, 0, value_ids)]
-                })]
-            })
-    return attribute_values
+            commands.append((0, 0, {
+                'attribute_id': attribute.id,
+                'value_ids': [(6, 0, value_ids)]
+            }))
+    # Write every attribute line in a single call.
+    if commands:
+        template.with_context(skip_variant_auto_create=True).write({'attribute_line_ids': commands})
+    return attribute_values, variant_rows
 
 
-def create_variant_manual(env, template, product, attribute_values):
+def compute_variant_vals(env, template, product, attribute_values, combo_index, ptav_cache):
     """
-    Create or update a single product variant based on variant string data.
+    Compute the values of a single product variant based on variant string data.
     
     This function:
-      - Parses the variant string into attribute-value pairs.
+      - Reads the parsed attribute-value pairs of the row.
       - Determines corresponding attribute value records.
-      - Either updates an existing variant (if a matching combination is found) or creates a new variant.
+      - Looks up an existing variant with a matching combination.
       - Sets up pricing and cost fields.
     
+    No product.product record is created or written here, so that callers can
+    batch the resulting values into a single create.
+    
     :param env: The current Odoo environment.
     :param template: The product.template record associated with the variant.
     :param product: A dictionary containing variant data from Excel.
     :param attribute_values: Mapping of attribute names to attribute value records.
-    :return: The created or updated product.product record, or None.
+    :param combo_index: Mapping of frozensets of template attribute value IDs to
+                        the template's existing variants.
+    :param ptav_cache: Cache of the template's product.template.attribute.value records.
+    :return: A tuple ``(existing_variant, vals)`` where ``existing_variant`` is the
+             matching product.product record or None, or None if the row has no variant.
+             The combination fields are only part of ``vals`` when no variant matched.
     """
-    variant_str = (product.get('variant') or '').strip()
-    if not variant_str:
+    # Convert the parsed variant pairs into a dictionary of attribute-value pairs.
+    variant_attrs = dict(get_variant_pairs(product))
+    if not variant_attrs:
         return None
 
-    # Convert the variant string into a dictionary of attribute-value pairs.
-    variant_attrs = {}
-    for part in variant_str.split(','):
-        if ':' in part:
-            attr, value = part.split(':', 1)
-            variant_attrs[attr.strip().lower()] = value.strip().lower()
-
     tmpl_attr_val_ids = []
     for attr_name, attr_value in variant_attrs.items():
         if attr_name not in attribute_values or attr_value not in attribute_values[attr_name]:
@@ -175,31 +375,24 @@ def create_variant_manual(env, template, product, attribute_values):
             continue
         attr_val = attribute_values[attr_name][attr_value]
         attribute = attr_val.attribute_id
-        tmpl_attr_val = get_or_create_template_attribute_value(env, template, attribute, attr_val)
+        tmpl_attr_val = get_or_create_template_attribute_value(ptav_cache, env, template, attribute, attr_val)
         tmpl_attr_val_ids.append(tmpl_attr_val.id)
 
-    # Create a unique combination string as a candidate identifier.
-    candidate_combination = ",".join(map(str, sorted(tmpl_attr_val_ids)))
-    existing_variant = None
-    for variant in template.product_variant_ids:
-        variant_combination = ",".join(map(str, sorted(variant.product_template_attribute_value_ids.ids)))
-        if variant_combination == candidate_combination:
-            existing_variant = variant
-            break
-
-    vals = {
-        'product_tmpl_id': template.id,
-        'product_template_attribute_value_ids': [(6, 0, tmpl_attr_val_ids)],
-        'combination_indices': candidate_combination,
-    }
+    # The set of attribute value IDs identifies the combination of the variant.
+    existing_variant = combo_index.get(frozenset(tmpl_attr_val_ids))
+    vals = {}
+    if not existing_variant:
+        # Only variants to create need their combination: a matched one keeps it.
+        vals.update({
+            'product_tmpl_id': template.id,
+            'product_template_attribute_value_ids': [(6, 0, tmpl_attr_val_ids)],
+            'combination_indices': ",".join(map(str, sorted(tmpl_attr_val_ids))),
+        })
 
     # Process the sale price if provided.
     sale_price = product.get('sale price')
     if sale_price:
-        try:
-            sale_price_val = float(sale_price)
-        except Exception:
-            sale_price_val = template.list_price
+        sale_price_val = _safe_float(sale_price, template.list_price)
         vals['lst_price'] = sale_price_val
         vals['fix_price'] = sale_price_val
     else:
@@ -209,60 +402,89 @@ def create_variant_manual(env, template, product, attribute_values):
     # Process the cost price.
     cost_price = product.get('cost price')
     if cost_price:
-        try:
-            cost_price_val = float(cost_price)
-        except Exception:
-            cost_price_val = template.standard_price
+        cost_price_val = _safe_float(cost_price, template.standard_price)
         vals['standard_price'] = cost_price_val
 
-    if existing_variant:
-        existing_variant.write(vals)
-        _logger.info("Updated variant '%s' for template '%s'.", variant_str, template.name)
-        return existing_variant
-    else:
-        variant = env['product.product'].create(vals)
-        _logger.info("Created variant '%s' for template '%s'.", variant_str, template.name)
-        return variant
+    return existing_variant, vals
 
 
-def update_variant_stock_quantity(env, variant, quantity):
+def bulk_update_stock(env, variant_qty_pairs):
     """
-    Update the on-hand stock quantity of a variant using the stock change wizard.
+    Update the on-hand stock quantity of several variants in one batch.
     
-    This function checks:
+    For each variant this function checks:
       - That the variant is associated with a product template.
-      - The product is consumable (type 'consu').
+      - The product is consumable (type 'consu') and storable.
       - That the product is not tracked by lot/serial.
-    Then it uses the wizard mechanism to update the quantity.
+      - That the quantity is not negative, as the stock change wizard requires.
+    The inventory quants of the remaining variants are then created in a
+    single call and applied together, the way the stock change wizard does
+    for a single product. If the batch fails, each variant is retried on its
+    own so that one failing variant does not discard the stock of the others.
+    Pairs without a quantity are ignored, and when a variant appears several
+    times the last quantity wins.
     
     :param env: The current Odoo environment.
-    :param variant: The product.product record (variant) to update.
-    :param quantity: The new stock quantity to set.
+    :param variant_qty_pairs: Iterable of (product.product record, quantity) pairs.
+    :return: The number of variants whose stock was updated.
     """
-    tmpl = variant.product_tmpl_id
-    if not tmpl:
-        _logger.warning("Variant '%s' has no associated product template; skipping stock update.", variant.default_code or variant.id)
-        return
+    quantities = {}
+    for variant, quantity in variant_qty_pairs:
+        if quantity is None:
+            continue
+        tmpl = variant.product_tmpl_id
+        if not tmpl:
+            _logger.warning("Variant '%s' has no associated product template; skipping stock update.", variant.default_code or variant.id)
+            continue
 
-    if tmpl.type != 'consu':
-        _logger.info("Product '%s' is not consumable; skipping stock update.", tmpl.name)
-        return
+        if tmpl.type != 'consu':
+            _logger.debug("Product '%s' is not consumable; skipping stock update.", tmpl.name)
+            continue
 
-    tracking = tmpl.tracking or 'none'
-    if tracking in ['lot', 'serial']:
-        _logger.info("Product '%s' is tracked by '%s'; skipping stock update.", tmpl.name, tracking)
-        return
+        if not tmpl.is_storable:
+            _logger.debug("Product '%s' is not storable; skipping stock update.", tmpl.name)
+            continue
 
+        tracking = tmpl.tracking or 'none'
+        if tracking in ['lot', 'serial']:
+            _logger.debug("Product '%s' is tracked by '%s'; skipping stock update.", tmpl.name, tracking)
+            continue
+
+        if quantity < 0:
+            _logger.error("Error updating stock for variant '%s': quantity cannot be negative (%s).", variant.default_code or variant.id, quantity)
+            continue
+        quantities[variant] = quantity
+
+    if not quantities:
+        return 0
+    warehouse = env['stock.warehouse'].search([('company_id', '=', env.company.id)], limit=1)
+    if not warehouse:
+        _logger.warning("No warehouse found for company '%s'; skipping stock update.", env.company.name)
+        return 0
+
+    quant_model = env['stock.quant'].with_context(inventory_mode=True)
+    quant_vals = {variant: {
+        'product_id': variant.id,
+        'location_id': warehouse.lot_stock_id.id,
+        'inventory_quantity': quantity,
+    } for variant, quantity in quantities.items()}
     try:
-        wizard = env['stock.change.product.qty'].create({
-            'product_id': variant.id,
-            'product_tmpl_id': tmpl.id,
-            'new_quantity': quantity,
-        })
-        wizard.change_product_qty()
-        _logger.info("Updated stock for variant '%s' to quantity %s.", variant.default_code or variant.id, quantity)
+        with env.cr.savepoint():
+            quant_model.create(list(quant_vals.values()))._apply_inventory()
+        _logger.debug("Updated stock for %s variants.", len(quant_vals))
+        return len(quant_vals)
     except Exception as e:
-        _logger.error("Error updating stock for variant '%s': %s", variant.default_code or variant.id, e)
+        _logger.warning("Batched stock update of %s variants failed (%s); retrying variant by variant.", len(quant_vals), e)
+
+    updated_count = 0
+    for variant, vals in quant_vals.items():
+        try:
+            with env.cr.savepoint():
+                quant_model.create(vals)._apply_inventory()
+            updated_count += 1
+        except Exception as e:
+            _logger.error("Error updating stock for variant '%s': %s", variant.default_code or variant.id, e)
+    return updated_count
 
 
 def clean_up_unwanted_variants(env, template, wanted_variants):
@@ -276,16 +498,19 @@ def clean_up_unwanted_variants(env, template, wanted_variants):
     :param wanted_variants: List of product.product records that should be kept.
     """
     existing_variants = template.product_variant_ids
-    wanted_combinations = []
-    for variant in wanted_variants:
-        if variant and hasattr(variant, 'combination_indices'):
-            wanted_combinations.append(variant.combination_indices)
-    variants_to_remove = []
-    for variant in existing_variants:
-        if hasattr(variant, 'combination_indices') and variant.combination_indices not in wanted_combinations:
-            variants_to_remove.append(variant.id)
     total_variants = len(existing_variants)
-    if total_variants > 1 and (total_variants - len(variants_to_remove)) >= 1:
+    # A single variant is never removed, so there is nothing to compare.
+    if total_variants <= 1:
+        _logger.info("Skipped variant removal for template '%s' to avoid leaving no variants.", template.name)
+        return
+    # Read the combinations of all variants in one query, without the other columns.
+    existing_variants.fetch(['combination_indices'])
+    wanted_combinations = {variant.combination_indices for variant in wanted_variants if variant}
+    variants_to_remove = [
+        variant.id for variant in existing_variants
+        if variant.combination_indices not in wanted_combinations
+    ]
+    if total_variants - len(variants_to_remove) >= 1:
         if variants_to_remove:
             env['product.product'].browse(variants_to_remove).unlink()
             _logger.info("Removed %s unwanted variants from template '%s' (ID: %s).", len(variants_to_remove), template.name, template.id)
@@ -314,127 +539,354 @@ def get_tracking_value(is_tracked, tracked_by):
     return 'none'
 
 
-def add_or_update_product_with_variants(env, product_data):
+def compute_template_vals(template_name, template_data, variants, uom_by_name):
     """
-    Process the list of product data dictionaries from an Excel file.
+    Compute the values of a product template from its data row.
     
-    This function groups the data by product template name,
-    updates or creates product templates, handles UoM conversion,
-    disables automatic variant creation, processes attribute lines,
-    creates/updates variants, and performs stock quantity updates.
+    :param template_name: The name of the product template.
+    :param template_data: The row holding the template data.
+    :param variants: List of rows holding the variant data of the template.
+    :param uom_by_name: Mapping returned by :func:`prefetch_uoms`.
+    :return: A dictionary of product.template values.
+    """
+    # Process UoM and product type fields.
+    uom_value = (template_data.get('uom') or 'Unit').strip()
+    purchase_uom_value = (template_data.get('purchase uom') or '').strip() or uom_value
+    product_type = (template_data.get('type') or 'consu').strip().lower()
+    is_tracked = str(template_data.get('is tracked') or '').strip().lower() == 'true'
+    tracked_by = (template_data.get('tracked by') or '').strip().lower()
+    # Determine storability based on product type and tracking.
+    is_storable = True if product_type != 'service' and is_tracked and (tracked_by == '' or tracked_by not in ['lot', 'serial']) \
+                        else str(template_data.get('is storable') or 'false').strip().lower() == 'true'
+    tracking_val = get_tracking_value(is_tracked, template_data.get('tracked by'))
+    lot_valuated = True if tracking_val in ['lot', 'serial'] else False
+
+    vals = {
+        'name': template_name,
+        'type': template_data.get('type', 'consu'),
+        'standard_price': _safe_float(template_data.get('cost price')),
+        'uom_id': get_uom_id(uom_by_name, uom_value),
+        'uom_po_id': get_uom_id(uom_by_name, purchase_uom_value),
+        'sale_ok': template_data.get('is saleable', True),
+        'purchase_ok': template_data.get('is purchasable', True),
+        'description': (template_data.get('internal notes') or '').strip(),
+        'is_storable': is_storable,
+        'tracking': tracking_val,
+        'lot_valuated': lot_valuated,
+    }
+    if not variants:
+        vals['list_price'] = _safe_float(template_data.get('sale price'))
+    return vals
+
+
+def write_template(product_tmpl, vals):
+    """
+    Update an existing product template with imported values.
+    
+    The list price is left untouched on templates with several variants,
+    since it is derived from the variant prices.
+    
+    :param product_tmpl: The product.template record.
+    :param vals: The values computed by :func:`compute_template_vals`.
+    """
+    if product_tmpl.product_variant_count > 1:
+        vals.pop('list_price', None)
+    product_tmpl.write(vals)
+
+
+def create_or_update_templates(env, groups, uom_by_name, template_by_name):
+    """
+    Create or update the product templates of a batch of grouped rows.
+    
+    Existing templates are written one by one, while all new templates of
+    the batch are created with a single ``create()`` call. Groups whose name
+    matches a template created in the same batch update that template.
     
     :param env: The current Odoo environment.
-    :param product_data: List of dictionaries containing product data.
+    :param groups: List of ``(template_name, template_data, variants)`` tuples.
+    :param uom_by_name: Mapping returned by :func:`prefetch_uoms`.
+    :param template_by_name: Mapping of lowercased names to existing product
+                             templates; created templates are added to it.
+    :return: The list of product.template records, in the order of ``groups``.
     """
-    templates_and_variants = {}
-    # Group rows by product template name.
-    for product in product_data:
-        name = (product.get('name') or '').strip()
-        if name:
-            if name not in templates_and_variants:
-                templates_and_variants[name] = {'template_data': product, 'variants': []}
-            else:
-                if product.get('variant'):
-                    templates_and_variants[name]['variants'].append(product)
+    templates = [None] * len(groups)
+    to_create = []
+    pending_names = set()
+    # Groups sharing their name with a template created in this batch.
+    deferred = []
+    for index, (template_name, template_data, variants) in enumerate(groups):
+        vals = compute_template_vals(template_name, template_data, variants, uom_by_name)
+        key = template_name.lower()
+        product_tmpl = template_by_name.get(key)
+        if product_tmpl:
+            write_template(product_tmpl, vals)
+            templates[index] = product_tmpl
+            _logger.info("Updated product template: %s", template_name)
+        elif key in pending_names:
+            deferred.append((index, vals))
         else:
-            # Variant rows without a template name are assigned to the last defined template.
-            last_template_name = list(templates_and_variants.keys())[-1] if templates_and_variants else None
-            if last_template_name:
-                templates_and_variants[last_template_name]['variants'].append(product)
-            else:
-                _logger.warning("Variant row encountered before any product template is defined. Skipping row.")
-
-    # Process each grouped template and its variants.
-    for template_name, data in templates_and_variants.items():
-        template_data = data['template_data']
-        variants = data['variants']
-        if template_data.get('variant'):
-            variants.insert(0, template_data)
-        product_tmpl = env['product.template'].search([('name', '=ilike', template_name)], limit=1)
-        
-        # Process UoM and product type fields.
-        uom_value = (template_data.get('uom') or 'Unit').strip()
-        purchase_uom_value = (template_data.get('purchase uom') or '').strip() or uom_value
-        product_type = (template_data.get('type') or 'consu').strip().lower()
-        is_tracked = str(template_data.get('is tracked') or '').strip().lower() == 'true'
-        tracked_by = (template_data.get('tracked by') or '').strip().lower()
-        # Determine storability based on product type and tracking.
-        is_storable = True if product_type != 'service' and is_tracked and (tracked_by == '' or tracked_by not in ['lot', 'serial']) \
-                            else str(template_data.get('is storable') or 'false').strip().lower() == 'true'
-        tracking_val = get_tracking_value(is_tracked, template_data.get('tracked by'))
-        lot_valuated = True if tracking_val in ['lot', 'serial'] else False
-
-        vals = {
-            'name': template_name,
-            'type': template_data.get('type', 'consu'),
-            'standard_price': float(template_data.get('cost price', 0)),
-            'uom_id': get_or_create_uom(env, uom_value),
-            'uom_po_id': get_or_create_uom(env, purchase_uom_value),
-            'sale_ok': template_data.get('is saleable', True),
-            'purchase_ok': template_data.get('is purchasable', True),
-            'description': (template_data.get('internal notes') or '').strip(),
-            'is_storable': is_storable,
-            'tracking': tracking_val,
-            'lot_valuated': lot_valuated,
-        }
-        if not variants:
-            vals['list_price'] = float(template_data.get('sale price', 0))
-        if not product_tmpl:
-            product_tmpl = env['product.template'].create(vals)
-            _logger.info("Created product template: %s", template_name)
+            pending_names.add(key)
+            to_create.append((index, vals))
+
+    if to_create:
+        created = env['product.template'].create([vals for _index, vals in to_create])
+        for (index, _vals), product_tmpl in zip(to_create, created):
+            templates[index] = product_tmpl
+            template_by_name[groups[index][0].lower()] = product_tmpl
+        _logger.info("Created %s product templates.", len(created))
+    for index, vals in deferred:
+        product_tmpl = template_by_name[groups[index][0].lower()]
+        write_template(product_tmpl, vals)
+        templates[index] = product_tmpl
+        _logger.info("Updated product template: %s", groups[index][0])
+    return templates
+
+
+def import_template(env, product_tmpl, template_name, template_data, variants, attribute_by_name, value_by_key):
+    """
+    Create or update the variants of one product template.
+    
+    Stock quantities are not applied here but returned to the caller. The
+    template list price is set to the lowest fix price of the imported
+    variants or, without variant rows, of the template's current variants.
+    
+    :param env: The current Odoo environment.
+    :param product_tmpl: The product.template record, already created or updated.
+    :param template_name: The name of the product template.
+    :param template_data: The row holding the template data.
+    :param variants: List of rows holding the variant data of the template.
+    :param attribute_by_name: Mapping returned by :func:`prefetch_attribute_values`.
+    :param value_by_key: Mapping returned by :func:`prefetch_attribute_values`.
+    :return: The (product.product record, quantity) pairs whose stock should be
+             updated, left to the caller so they can be applied in one batch.
+    """
+    # Setup attributes from the variant data.
+    attribute_values, variant_rows = setup_template_attributes(env, product_tmpl, variants, attribute_by_name, value_by_key)
+    ptav_cache = prefetch_template_attribute_values(env, product_tmpl, attribute_values)
+    
+    # Load only the combination of the existing variants, in a single query.
+    existing_variants = product_tmpl.product_variant_ids
+    existing_variants.fetch(['combination_indices'])
+    combo_index = {
+        frozenset(int(ptav_id) for ptav_id in (variant.combination_indices or '').split(',') if ptav_id): variant
+        for variant in existing_variants
+    }
+    created_variants = []
+    stock_updates = []
+    to_create = []
+    create_index_by_combination = {}
+    to_write = {}
+    # Each entry is (row, existing variant, index in to_create).
+    variant_targets = []
+    # Compute the values of every variant row, then write and create them in batch.
+    for variant_data in variant_rows:
+        result = compute_variant_vals(env, product_tmpl, variant_data, attribute_values, combo_index, ptav_cache)
+        if not result:
+            continue
+        existing_variant, variant_vals = result
+        if existing_variant:
+            # The variant was matched on its combination, so only its other values can change.
+            to_write.setdefault(existing_variant, {}).update(variant_vals)
+            variant_targets.append((variant_data, existing_variant, None))
+            continue
+        # Rows repeating a combination in the same file update the pending values.
+        combination = variant_vals['combination_indices']
+        index = create_index_by_combination.get(combination)
+        if index is None:
+            index = create_index_by_combination[combination] = len(to_create)
+            to_create.append(variant_vals)
         else:
-            if product_tmpl.product_variant_count > 1:
-                vals.pop('list_price', None)
-            product_tmpl.write(vals)
-            _logger.info("Updated product template: %s", template_name)
-        env.cr.commit()  # Commit changes as needed.
-
-        # Reload the updated template record.
-        product_tmpl = env['product.template'].browse(product_tmpl.id)
-        disable_variant_auto_creation(env, product_tmpl)
-        
-        # Setup attributes from the variant data.
-        all_variant_data = variants.copy()
-        attribute_values = setup_template_attributes(env, product_tmpl, all_variant_data)
-        
-        created_variants = []
-        # Process each variant row to create or update corresponding product.product records.
-        for variant_data in all_variant_data:
-            if variant_data.get('variant'):
-                variant = create_variant_manual(env, product_tmpl, variant_data, attribute_values)
-                if variant:
-                    created_variants.append(variant)
-                    variant_stock = variant_data.get('stock quantity')
-                    if variant_stock is not None:
-                        try:
-                            qty_value = float(variant_stock)
-                        except Exception:
-                            qty_value = 0.0
-                        update_variant_stock_quantity(env, variant, qty_value)
-        # If no variants exist, create a single variant.
-        if not variants and len(product_tmpl.product_variant_ids) == 0:
+            to_create[index].update(variant_vals)
+        variant_targets.append((variant_data, None, index))
+
+    # Write existing variants sharing the same values together.
+    variant_ids_by_vals = defaultdict(list)
+    for variant, variant_vals in to_write.items():
+        variant_ids_by_vals[tuple(sorted(variant_vals.items()))].append(variant.id)
+    for vals_key, variant_ids in variant_ids_by_vals.items():
+        env['product.product'].browse(variant_ids).write(dict(vals_key))
+    updated_count = len(to_write)
+    _logger.debug("Updated %s variants of template '%s' in %s writes.", updated_count, template_name, len(variant_ids_by_vals))
+
+    new_variants = env['product.product'].create(to_create) if to_create else env['product.product']
+    created_count = len(new_variants)
+    for variant_data, variant, index in variant_targets:
+        if variant is None:
+            variant = new_variants[index]
+        created_variants.append(variant)
+        variant_stock = variant_data.get('stock quantity')
+        if variant_stock is not None:
+            stock_updates.append((variant, _safe_float(variant_stock)))
+    if not variants:
+        # Without variant rows the stock goes to the template's single variant,
+        # which is created if the template has none yet.
+        variant = product_tmpl.product_variant_ids[:1]
+        if not variant:
             variant = env['product.product'].create({'product_tmpl_id': product_tmpl.id})
             created_variants.append(variant)
-            template_stock = template_data.get('stock quantity')
-            if template_stock is not None:
-                try:
-                    qty_value = float(template_stock)
-                except Exception:
-                    qty_value = 0.0
-                update_variant_stock_quantity(env, variant, qty_value)
-            _logger.info("Created single variant for template: %s", template_name)
-        if not variants:
-            update_variant_stock_quantity(env, product_tmpl.product_variant_ids[0], template_data.get('stock quantity'))
-        env.cr.commit()
-
-        product_tmpl = env['product.template'].browse(product_tmpl.id)
-        has_variant_data = any((v.get('variant') or '').strip() for v in all_variant_data)
-        if has_variant_data:
-            clean_up_unwanted_variants(env, product_tmpl, created_variants)
-        else:
-            _logger.info("Skipping variant removal for '%s' because no variant data was provided.", template_name)
+            created_count += 1
+            _logger.debug("Created single variant for template: %s", template_name)
+        template_stock = template_data.get('stock quantity')
+        if template_stock is not None:
+            stock_updates.append((variant, _safe_float(template_stock)))
+    _logger.info(
+        "Template '%s': %s variants created, %s updated, %s pending stock updates.",
+        template_name, created_count, updated_count, len(stock_updates),
+    )
+
+    # Only the variant fields need to be re-read after the creations above.
+    product_tmpl.invalidate_recordset(['product_variant_ids', 'product_variant_count'])
+    if variant_rows:
+        clean_up_unwanted_variants(env, product_tmpl, created_variants)
+    else:
+        _logger.info("Skipping variant removal for '%s' because no variant data was provided.", template_name)
+    if variant_rows:
+        # The imported variants are the ones kept by the cleanup above, and their
+        # prices are known from the values just written: no need to read them back.
+        variant_prices = [vals['fix_price'] for vals in to_create]
+        variant_prices += [vals['fix_price'] for vals in to_write.values() if 'fix_price' in vals]
+    else:
+        # Without variant rows the price comes from the template's current variants.
         variant_prices = product_tmpl.product_variant_ids.mapped('fix_price')
-        if variant_prices:
-            stored_price = min(variant_prices)
+    if variant_prices:
+        stored_price = min(variant_prices)
+        if stored_price != product_tmpl.list_price:
             product_tmpl.write({'list_price': stored_price})
             _logger.info("Set template '%s' list_price to minimum variant price: %s", template_name, stored_price)
+    return stock_updates
+
+
+def iter_template_groups(product_data):
+    """
+    Group streamed rows by product template name, one template at a time.
+    
+    Rows are consumed lazily and the group of a template is yielded as soon
+    as a row names the next template, so only the rows of the current
+    template are held here. The rows of a template must therefore be
+    contiguous: rows without a name belong to the last named template, and
+    a name found again after another template is refused.
+    
+    :param product_data: Iterable of dictionaries containing product data.
+    :return: A generator of ``(template_name, template_data, variants)`` tuples.
+    :raises UserError: If the rows of a template are not contiguous.
+    """
+    seen_names = set()
+    template_name = template_data = None
+    variants = []
+    for product in product_data:
+        # Parse the variant string and numeric columns once; the helpers reuse them.
+        get_variant_pairs(product)
+        coerce_numeric_columns(product)
+        name = (product.get('name') or '').strip()
+        if not name or name == template_name:
+            if template_name is None:
+                _logger.warning("Variant row encountered before any product template is defined. Skipping row.")
+            elif not name or product.get('variant'):
+                # Variant rows without a template name are assigned to the last named template.
+                variants.append(product)
+            continue
+        if name in seen_names:
+            raise UserError(_(
+                "The rows of product template '%s' are not contiguous. "
+                "Keep all rows of a template together in the file."
+            ) % name)
+        if template_name is not None:
+            yield template_name, template_data, variants
+        seen_names.add(name)
+        # A template row holding a variant is the first variant of its template.
+        template_name, template_data = name, product
+        variants = [product] if product.get('variant') else []
+    if template_name is not None:
+        yield template_name, template_data, variants
+
+
+def import_template_batch(env, groups):
+    """
+    Import one batch of grouped templates and their variants.
+    
+    UoMs, existing templates, attributes and attribute values are resolved
+    once for the whole batch, new templates are created together and the
+    stock quantities of the batch are applied in a single update.
+    
+    :param env: The current Odoo environment.
+    :param groups: List of tuples yielded by :func:`iter_template_groups`.
+    """
+    # Resolve every referenced UoM up front instead of searching per template.
+    uom_names = set()
+    for _name, template_data, _variants in groups:
+        uom_value = (template_data.get('uom') or 'Unit').strip()
+        uom_names.add(uom_value)
+        uom_names.add((template_data.get('purchase uom') or '').strip() or uom_value)
+    uom_by_name = prefetch_uoms(env, uom_names)
+    template_by_name = prefetch_records_by_name(env, 'product.template', [group[0] for group in groups])
+    # Resolve all attributes and values of the batch at once as well.
+    attribute_by_name, value_by_key = prefetch_attribute_values(
+        env, (row for _name, _data, variants in groups for row in variants),
+    )
+
+    templates = create_or_update_templates(env, groups, uom_by_name, template_by_name)
+    stock_updates = []
+    for (template_name, template_data, variants), product_tmpl in zip(groups, templates):
+        stock_updates += import_template(
+            env, product_tmpl, template_name, template_data, variants, attribute_by_name, value_by_key,
+        )
+    # Apply the stock quantities of the whole batch at once.
+    stock_updated_count = bulk_update_stock(env, stock_updates)
+    _logger.info("Updated stock for %s variants.", stock_updated_count)
+
+
+def add_or_update_product_with_variants(env, product_data, commit_every=None):
+    """
+    Process the product data dictionaries from an Excel file.
+    
+    This function groups the data by product template name,
+    updates or creates product templates, handles UoM conversion,
+    processes attribute lines, creates/updates variants, removes the
+    variants Odoo generated that the file does not list, and performs
+    stock quantity updates.
+    
+    Rows may be given as a generator: templates are read one at a time and
+    imported in batches of ``commit_every``, or :data:`IMPORT_BATCH_SIZE`,
+    templates, so memory holds one batch rather than the whole file. The
+    rows of each template must be contiguous.
+    
+    By default the whole import runs in the caller's transaction: nothing is
+    committed or rolled back here, and a failure is re-raised for the caller
+    to handle. For very large files, ``commit_every`` commits after each
+    batch of that many templates instead, at the cost of looser failure
+    atomicity: on error only the templates processed since the last commit
+    are rolled back.
+    
+    Mail tracking, creation messages and follower subscriptions are disabled
+    for all records written by the import.
+    
+    :param env: The current Odoo environment.
+    :param product_data: Iterable of dictionaries containing product data.
+    :param commit_every: Number of templates to process between commits, or
+                         None to leave committing to the caller.
+    :raises UserError: If the rows of a template are not contiguous.
+    """
+    # Skip mail.thread tracking, logging and subscriptions on every create/write.
+    env = env(context=dict(
+        env.context,
+        tracking_disable=True,
+        mail_create_nolog=True,
+        mail_notrack=True,
+        mail_create_nosubscribe=True,
+    ))
+    groups = iter_template_groups(product_data)
+    batch_size = commit_every or IMPORT_BATCH_SIZE
+    # Process each batch of grouped templates, optionally committing after
+    # each one; with batched commits, a failure rolls back the uncommitted batch.
+    try:
+        while True:
+            batch = list(islice(groups, batch_size))
+            if not batch:
+                break
+            import_template_batch(env, batch)
+            if commit_every:
+                env.cr.commit()
+    except Exception:
+        if commit_every:
+            env.cr.rollback()
+        raise
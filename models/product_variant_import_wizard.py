@@ -9,7 +9,6 @@ a sample template file.
 import base64
 import io
 import openpyxl
-import logging
 
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
@@ -17,8 +16,6 @@ from odoo.exceptions import UserError
 # Import the main helper function from the helper file.
 from .import_variant_helpers import add_or_update_product_with_variants
 
-_logger = logging.getLogger(__name__)
-
 
 class ProductVariantImportWizard(models.TransientModel):
     """
@@ -40,8 +37,8 @@ class ProductVariantImportWizard(models.TransientModel):
         
         The method performs the following steps:
           1. Validates and decodes the uploaded Base64 file data.
-          2. Loads the Excel workbook using openpyxl.
-          3. Reads header and data rows to form a list of dictionaries.
+          2. Loads the Excel workbook using openpyxl in read-only mode.
+          3. Reads the header row and streams the data rows as dictionaries.
           4. Calls the helper function to process and update products/variants.
           5. Closes the wizard window upon successful import.
         
@@ -59,23 +56,23 @@ class ProductVariantImportWizard(models.TransientModel):
             raise UserError(_("The file could not be decoded. Please try again."))
 
         try:
-            workbook = openpyxl.load_workbook(io.BytesIO(file_data))
+            # Read-only mode streams the rows instead of building every cell in memory.
+            workbook = openpyxl.load_workbook(io.BytesIO(file_data), read_only=True, data_only=True)
             sheet = workbook.active
         except Exception as e:
             raise UserError(_("Error reading Excel file: %s") % str(e))
 
-        headers = [str(cell.value).strip().lower() if cell.value else '' for cell in sheet[1]]
-        product_data = []
-        for row in sheet.iter_rows(min_row=2, values_only=True):
-            product = dict(zip(headers, row))
-            product_data.append(product)
-
-        _logger.info("Product import data: %s", product_data)
-
         try:
-            add_or_update_product_with_variants(self.env, product_data)
-        except Exception as e:
-            raise UserError(_("Import failed: %s") % e)
+            rows = sheet.iter_rows(values_only=True)
+            headers = [str(value).strip().lower() if value else '' for value in next(rows, ())]
+            # Stream the rows: the helper imports them one batch of templates at a time.
+            product_data = (dict(zip(headers, row)) for row in rows)
+            try:
+                add_or_update_product_with_variants(self.env, product_data)
+            except Exception as e:
+                raise UserError(_("Import failed: %s") % e)
+        finally:
+            workbook.close()
 
         return {'type': 'ir.actions.act_window_close'}
 
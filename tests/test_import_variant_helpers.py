@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the product variant import helpers.
+
+They cover the parsing of cell values, the grouping of streamed rows by
+template, and the import of those groups in batches, including the
+batched stock update.
+"""
+
+from datetime import datetime
+from unittest.mock import patch
+
+from odoo.exceptions import UserError
+from odoo.tests import TransactionCase, tagged
+
+from ..models.import_variant_helpers import (
+    _safe_float,
+    add_or_update_product_with_variants,
+    coerce_numeric_columns,
+    iter_template_groups,
+    parse_variant,
+)
+
+
+@tagged('post_install', '-at_install')
+class TestImportVariantHelpers(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.uom_name = cls.env.ref('uom.product_uom_unit').name
+
+    def _row(self, name=None, variant=None, **values):
+        """Build an import row; keyword names use underscores for spaces."""
+        row = {'name': name, 'variant': variant}
+        row.update((key.replace('_', ' '), value) for key, value in values.items())
+        if name:
+            row.setdefault('uom', self.uom_name)
+            row.setdefault('type', 'consu')
+        return row
+
+    def _template(self, name):
+        return self.env['product.template'].search([('name', '=', name)])
+
+    def _variant(self, template, value):
+        return template.product_variant_ids.filtered(
+            lambda v: v.product_template_attribute_value_ids.name.lower() == value
+        )
+
+    # Cell values
+
+    def test_parse_variant(self):
+        self.assertEqual(parse_variant(" Color: Red , Size:M"), (('color', 'red'), ('size', 'm')))
+        self.assertEqual(parse_variant("Size: XL:2"), (('size', 'xl:2'),))
+        self.assertEqual(parse_variant("no pair, Size:S"), (('size', 's'),))
+        self.assertEqual(parse_variant(""), ())
+        self.assertEqual(parse_variant(None), ())
+
+    def test_coerce_numeric_columns(self):
+        row = coerce_numeric_columns({
+            'sale price': 10,
+            'cost price': ' 2.5 ',
+            'stock quantity': '  ',
+            'name': '7',
+        })
+        self.assertEqual(row, {'sale price': 10.0, 'cost price': 2.5, 'stock quantity': None, 'name': '7'})
+        self.assertIsInstance(row['sale price'], float)
+        # Text that is not a number is left for _safe_float to fall back on.
+        self.assertEqual(coerce_numeric_columns({'sale price': 'n/a'}), {'sale price': 'n/a'})
+
+    def test_safe_float(self):
+        self.assertEqual(_safe_float(3.5), 3.5)
+        self.assertEqual(_safe_float(4), 4.0)
+        self.assertEqual(_safe_float(' 1.25 '), 1.25)
+        self.assertEqual(_safe_float(None), 0.0)
+        self.assertEqual(_safe_float(False), 0.0)
+        self.assertEqual(_safe_float('  ', 7.0), 7.0)
+        self.assertEqual(_safe_float('n/a', 7.0), 7.0)
+        # openpyxl returns date-formatted cells as datetime objects.
+        self.assertEqual(_safe_float(datetime(2020, 1, 1), 7.0), 7.0)
+
+    # Grouping
+
+    def test_groups_contiguous_rows(self):
+        rows = [
+            self._row('A'),
+            self._row(variant='size:s'),
+            self._row('A', 'size:m'),
+            # A repeated template row without a variant adds nothing.
+            self._row('A'),
+            self._row('B'),
+        ]
+        groups = list(iter_template_groups(rows))
+        self.assertEqual([(name, data) for name, data, _variants in groups], [('A', rows[0]), ('B', rows[4])])
+        self.assertEqual(groups[0][2], rows[1:3])
+        self.assertEqual(groups[1][2], [])
+
+    def test_template_row_with_variant_leads_its_variants(self):
+        rows = [self._row('A', 'size:s'), self._row(variant='size:m')]
+        [(_name, template_data, variants)] = iter_template_groups(rows)
+        self.assertEqual(variants, [template_data, rows[1]])
+
+    def test_groups_are_yielded_as_rows_stream(self):
+        rows = iter([self._row('A'), self._row('B'), self._row('C')])
+        groups = iter_template_groups(rows)
+        self.assertEqual(next(groups)[0], 'A')
+        # Only the row naming the next template has been read so far.
+        self.assertEqual(next(rows)['name'], 'C')
+
+    def test_non_contiguous_rows_are_refused(self):
+        rows = [self._row('A'), self._row('B'), self._row('A', 'size:m')]
+        with self.assertRaises(UserError):
+            list(iter_template_groups(rows))
+
+    def test_nameless_rows_before_any_template_are_skipped(self):
+        rows = [self._row(variant='size:s'), self._row('A')]
+        groups = list(iter_template_groups(rows))
+        self.assertEqual([(name, variants) for name, _data, variants in groups], [('A', [])])
+
+    def test_case_variant_names(self):
+        rows = [
+            self._row('Test Import Shirt', sale_price=10.0),
+            self._row('test import shirt', sale_price=12.0),
+        ]
+        groups = list(iter_template_groups(rows))
+        self.assertEqual([group[0] for group in groups], ['Test Import Shirt', 'test import shirt'])
+
+        add_or_update_product_with_variants(self.env, rows)
+        templates = self.env['product.template'].search([('name', '=ilike', 'test import shirt')])
+        self.assertEqual(len(templates), 1)
+
+    # Import
+
+    def test_import_creates_variants_and_prices(self):
+        rows = [
+            self._row('Test Import Tee', 'test import size:s', sale_price=10.0),
+            self._row(variant='test import size:m', sale_price=20.0),
+        ]
+        add_or_update_product_with_variants(self.env, rows)
+        template = self._template('Test Import Tee')
+        self.assertEqual(len(template.product_variant_ids), 2)
+        self.assertEqual(template.list_price, 10.0)
+
+    def test_batches_commit_every_n_templates(self):
+        rows = [self._row('Test Import A'), self._row('Test Import B'), self._row('Test Import C')]
+        with patch.object(self.env.cr, 'commit') as commit:
+            add_or_update_product_with_variants(self.env, rows, commit_every=2)
+        self.assertEqual(commit.call_count, 2)
+        self.assertEqual(len(self.env['product.template'].search([('name', '=like', 'Test Import _')])), 3)
+
+    def test_batches_keep_existing_variants(self):
+        attribute = self.env['product.attribute'].create({
+            'name': 'test import size',
+            'value_ids': [(0, 0, {'name': name}) for name in ('s', 'm', 'l')],
+        })
+        template = self.env['product.template'].create({
+            'name': 'Test Import Tee',
+            'attribute_line_ids': [(0, 0, {
+                'attribute_id': attribute.id,
+                'value_ids': [(6, 0, attribute.value_ids.ids)],
+            })],
+        })
+        variant_ids = set(template.product_variant_ids.ids)
+        self.assertEqual(len(variant_ids), 3)
+
+        rows = [
+            self._row('Test Import Before'),
+            self._row('Test Import Tee', 'test import size:s'),
+            self._row(variant='test import size:m'),
+            self._row(variant='test import size:l'),
+            self._row('Test Import After'),
+        ]
+        # One template per batch, committed without leaving the test transaction.
+        with patch.object(self.env.cr, 'commit', self.env.flush_all):
+            add_or_update_product_with_variants(self.env, rows, commit_every=1)
+
+        template.invalidate_recordset(['product_variant_ids'])
+        self.assertEqual(set(template.product_variant_ids.ids), variant_ids)
+        self.assertEqual(len(template.attribute_line_ids.value_ids), 3)
+
+    def test_batched_stock_update(self):
+        rows = [
+            self._row('Test Import Storable', 'test import size:s', is_storable='true', stock_quantity=5),
+            self._row(variant='test import size:m', stock_quantity=7),
+            self._row(variant='test import size:l', stock_quantity=-2),
+            # Not storable: its stock must not discard the stock of the other template.
+            self._row('Test Import Consumable', stock_quantity=3),
+        ]
+        add_or_update_product_with_variants(self.env, rows)
+
+        storable = self._template('Test Import Storable')
+        self.assertEqual(self._variant(storable, 's').qty_available, 5)
+        self.assertEqual(self._variant(storable, 'm').qty_available, 7)
+        # Negative quantities are refused, as the stock change wizard does.
+        self.assertEqual(self._variant(storable, 'l').qty_available, 0)
+
+        consumable = self._template('Test Import Consumable')
+        self.assertFalse(self.env['stock.quant'].search_count([('product_id', 'in', consumable.product_variant_ids.ids)]))